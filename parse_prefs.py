@@ -3,8 +3,16 @@
 
 import argparse
 
+import numpy as np
 import pandas as pd
 
+PREFERENCES = {
+    "Very much preferred": 1,
+    "Preferred": 2,
+    "Neutral": 3,
+    "Do not prefer": 4,
+}
+
 
 def main() -> None:
     """Drive preference parser."""
@@ -33,29 +41,24 @@ def main() -> None:
         name="Assignment",
     )
 
-    col_2 = pd.Series(totals, name="Counts")
-
-    responses = pd.read_csv(args.input)
-    responses_clean = (
-        responses.iloc[:, 2:-2]
-        .transpose()
-        .reset_index(drop=True)
-        .replace(
-            {"Very much preferred": 1, "Preferred": 2, "Neutral": 3, "Do not prefer": 4}
-        )
-    )
-    responses_clean.columns = responses_clean.iloc[0]
-    responses_clean = responses_clean[1:]
-    responses_clean = pd.concat(
-        [
-            pd.DataFrame(
-                [[1] * len(responses_clean.columns)], columns=responses_clean.columns
-            ),
-            responses_clean,
-        ]
+    # Only read the name and preference columns of the form, mapping answers
+    # to 1-4 as they are parsed so the answer strings are never kept around.
+    header = pd.read_csv(args.input, nrows=0).columns
+    responses = pd.read_csv(
+        args.input,
+        usecols=range(2, len(header) - 2),
+        converters={column: PREFERENCES.__getitem__ for column in header[3:-2]},
     )
+    names = responses.iloc[:, 0]
+
+    # Rows become committees, columns persons.
+    arr = responses.iloc[:, 1:].to_numpy(dtype=np.int8).T
+    # Every person takes one committee.
+    arr = np.vstack([np.ones((1, arr.shape[1]), dtype=np.int8), arr])
 
-    prefs = pd.concat([col_1, col_2, responses_clean], axis=1)
+    prefs = pd.DataFrame(arr, columns=names)
+    prefs.insert(0, "Counts", totals)
+    prefs.insert(0, "Assignment", col_1)
     prefs.to_csv(args.output, index=False)
 
 
@@ -3,192 +3,241 @@
 import argparse
 import csv
 import logging
-import math
 from collections import defaultdict
+from collections.abc import Iterable
 
-import cvxpy as cvx
+import numpy as np
 import pandas as pd
+from scipy import sparse
+from scipy.optimize import Bounds, LinearConstraint, milp
 
 
 # Configuration parameters.
 LOGGING_FILENAME = "scheduling.log"
 WEIGHTS = {1: 1, 2: 4, 3: 100, 4: 10000}
 WEIGHTS_TO_PREF = {1: 1, 4: 2, 100: 3, 10000: 4}
+MILP_OPTIONS = {"mip_rel_gap": 1e-6, "presolve": True, "time_limit": 60}
 
 
-def make_unique(lst: pd.Series) -> list[str]:
+def make_unique(lst: Iterable[str]) -> list[str]:
     """
     Take a list of str items, and checks the list for non-unique entries.
     If any non-unique entries are found, it replaces them by appending
     a _1, _2 under them to make them all unique.
     """
-    counts: dict[str, int] = defaultdict(int)
-    for item in lst:
-        counts[item] += 1
-
-    uniqified_lst = []
-    for item in lst:
-        if counts[item] > 1:
-            # Start re-labeling item from the back.
-            new_item = f"{item}_{counts[item]}"
-            logging.warning(f"Found duplicate items. Rewriting {item} to {new_item}")
-            uniqified_lst.append(new_item)
-            counts[item] -= 1  # Decrement counts for proper future relabeling
-        else:
-            uniqified_lst.append(item)
-
-    return uniqified_lst
+    items = pd.Series(list(lst))
+    duplicated = items.duplicated(keep=False)
+    if not duplicated.any():
+        return items.tolist()
+
+    # Label duplicates from the back: the last occurrence keeps its name and
+    # earlier ones count down to _2.
+    suffixes = items.groupby(items, dropna=False).cumcount(ascending=False) + 1
+    rewrite = duplicated & suffixes.gt(1)
+    relabeled = items.astype(str) + "_" + suffixes.astype(str)
+    logging.warning(
+        "Found duplicate items. Rewriting %s to %s",
+        items[rewrite].tolist(),
+        relabeled[rewrite].tolist(),
+    )
+    return items.where(~rewrite, relabeled).tolist()
 
 
 def parse_csv(
     filename: str, no_custom_counts: bool = False, weights: dict[int, int] = WEIGHTS
-) -> tuple[dict, dict, dict, dict]:
-    """Take custom CSV format and extract weights and preferences."""
-    # Process provided CSV.
-    preferences_by_assignment = defaultdict(list)
-    preferences_by_persons = defaultdict(list)
-    counts_by_assignment = {}
-    counts_by_persons = {}
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, list[str], list[str]]:
+    """Take custom CSV format and extract weights and preferences.
 
-    df = pd.read_csv(filename)
-    assignments = make_unique(df.Assignment)
+    Returns a persons x assignments matrix of weighted preferences, the
+    person and assignment count vectors, and the ordered persons and
+    assignments labelling the matrix rows and columns.
+    """
+    # Process provided CSV.
     # Skip first element because it is the diagonal header.
     # If counts are present, need to skip the first 2 rows.
     offset = 1 if no_custom_counts else 2
+    # Read preferences and counts as wide ints and only narrow them once they
+    # are validated, since narrow dtypes silently wrap out-of-range values.
+    header = pd.read_csv(filename, nrows=0).columns
+    dtypes = {column: "Int64" for column in header[offset:]}
+    if not no_custom_counts:
+        dtypes[header[1]] = "Int64"
+    df = pd.read_csv(filename, dtype=dtypes)
+    # Index plain arrays from here on rather than building a Series per row.
+    block = df.iloc[:, offset:].to_numpy(dtype=np.int64)
+    assignments = make_unique(df.Assignment.to_numpy())[offset - 1 :]
 
     # We want persons to be uniquely identifiable by their name.
-    persons = make_unique(df.columns.values.tolist()[offset:])
+    persons = make_unique(df.columns.to_numpy()[offset:])
 
     if no_custom_counts:
-        counts_by_persons = {person: 1 for person in persons}
+        person_counts = np.ones(len(persons), dtype=np.int32)
+        assignment_counts = np.ones(len(assignments), dtype=np.int32)
     else:
-        counts = df[0:1].values.tolist()[0][offset:]
-        counts_by_persons = {
-            person: int(count) for person, count in zip(persons, counts)
-        }
-
-    for index, row in df.iterrows():
-        if index == 0 and not no_custom_counts:
-            continue
-        logging.debug(f"Working on row {row}")
-        assignment = assignments[index]
-        if no_custom_counts:
-            counts_by_assignment[assignment] = 1
-        else:
-            count = row.iloc[1]
-            counts_by_assignment[assignment] = int(count)
-
-        preferences = row[offset:]
-        for i, preference in enumerate(preferences):
-            person = persons[i]
-            preference = weights[int(preference)]
-            preferences_by_assignment[assignment].append((person, preference))
-            preferences_by_persons[person].append((assignment, preference))
-
-    logging.info(f"Number of persons {len(preferences_by_persons)}")
-    logging.info(f"Number of assignments {len(preferences_by_assignment)}")
-    return (
-        counts_by_persons,
-        counts_by_assignment,
-        preferences_by_persons,
-        preferences_by_assignment,
-    )
-
-
-def str_bounds_expr(left, bounds: str, right) -> bool:
-    """Parse bounds expression as boolean comparison."""
+        person_counts = block[0]
+        assignment_counts = df.iloc[1:, 1].to_numpy(dtype=np.int64)
+        # A person takes each assignment at most once.
+        if ((person_counts < 0) | (person_counts > len(assignments))).any():
+            raise ValueError(f"Person counts must be between 0 and {len(assignments)}")
+        if (
+            (assignment_counts < 0) | (assignment_counts > np.iinfo(np.int32).max)
+        ).any():
+            raise ValueError("Assignment counts must be non-negative 32-bit ints")
+        person_counts = person_counts.astype(np.int32)
+        assignment_counts = assignment_counts.astype(np.int32)
+
+    # Map preferences to weights with a single lookup table gather.
+    # The CSV lays out assignments as rows and persons as columns; the solver
+    # wants one row per person.
+    # Validate before narrowing to int8, which would wrap out-of-range values.
+    raw = block[offset - 1 :]
+    if not np.isin(raw, list(weights)).all():
+        raise ValueError(f"Preferences must be one of {sorted(weights)}")
+    lut = np.zeros(max(weights) + 1, dtype=np.int32)
+    lut[list(weights)] = list(weights.values())
+    preference_matrix = lut[raw.astype(np.int8).T]
+
+    logging.info("Number of persons %d", len(persons))
+    logging.info("Number of assignments %d", len(assignments))
+    return preference_matrix, person_counts, assignment_counts, persons, assignments
+
+
+def bounds_limits(
+    bounds: str, counts: np.ndarray, total: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """Turn a bounds choice into lower and upper limits on the counts."""
     if bounds == "equal":
-        return left == right
+        return counts, counts
     if bounds == "lower":
-        return left >= right
+        # No assignment can take more than every person's full count.
+        return counts, np.full_like(counts, total)
     if bounds == "upper":
-        return right >= left
+        return np.zeros_like(counts), counts
     raise NotImplementedError("Bounds must be {equal, lower, upper}")
 
 
-def create_ilp(preferences_by_persons, counts_by_persons, counts_by_assignment, bounds):
-    """Convert preferences and weights into linear programming problem."""
-    cost = 0
-    variables_by_persons = defaultdict(list)
-    constraints_by_persons = defaultdict(int)
-    constraints_by_assignment = defaultdict(int)
-
-    # Create variables and partial constraints for assignment x person cross product.
-    logging.debug("Creating variables")
-    for person, item in preferences_by_persons.items():
-        for assignment, preference in item:
-            variable = cvx.Variable(1, boolean=True)
-            variables_by_persons[person].append((preference, assignment, variable))
-
-            cost += preference * variable
-
-            constraints_by_persons[person] += variable
-            constraints_by_assignment[assignment] += variable
-
-    # Constraint that each person must be assigned one assignment.
-    # The way constraints are listed in CVXPY are in a list
-    # [x+y<=1, x+z==1, ...].
-    # The following creates a list of the form
-    # [sum(person 1's variables) == person 1's count,
-    #  sum(person 2's variables) == person 2's count,
-    #  ...]
-    persons_constraint = list(
-        {
-            k: v == counts_by_persons[k] for (k, v) in constraints_by_persons.items()
-        }.values()
+def group_persons(
+    preference_matrix: np.ndarray, person_counts: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Collapse persons with identical preferences and counts into groups.
+    Such persons are interchangeable, so the ILP only needs to decide how
+    many of each group go to each assignment.
+    Returns each group's preferences, per-person count and size, and the
+    group of every person.
+    """
+    keys = np.column_stack([preference_matrix, person_counts])
+    unique_keys, group_of_person, group_sizes = np.unique(
+        keys, axis=0, return_inverse=True, return_counts=True
     )
-
-    # Constraint that each assignment must have only one person.
-    # Works similarly as above.
-    assignments_constraint = list(
-        {
-            k: str_bounds_expr(v, bounds, counts_by_assignment[k])
-            for (k, v) in constraints_by_assignment.items()
-        }.values()
+    return (
+        unique_keys[:, :-1],
+        unique_keys[:, -1],
+        group_sizes,
+        group_of_person.ravel(),
     )
-    logging.debug("Created constraints.")
-    return variables_by_persons, cost, persons_constraint, assignments_constraint
-
 
-def solve_ilp(cost, persons_constraint, assignments_constraint) -> None:
-    """Perform CVX Magic."""
-    obj = cvx.Minimize(cost)
-    prob = cvx.Problem(obj, persons_constraint + assignments_constraint)
-    logging.debug("Using CVX to solve")
-    prob.solve()
 
-    logging.info(f"Problem Value {prob.value}")
-    if prob.status != "optimal":
-        logging.warning(f"Problem status is not optimal but is instead {prob.status}")
+def create_ilp(
+    group_preferences: np.ndarray,
+    group_counts: np.ndarray,
+    group_sizes: np.ndarray,
+    assignment_counts: np.ndarray,
+    bounds: str,
+) -> tuple[np.ndarray, list[LinearConstraint], Bounds]:
+    """Convert preferences and weights into linear programming problem."""
+    n_groups, n_assignments = group_preferences.shape
+    # One integer variable per (group, assignment) cell, in row-major order,
+    # counting the group's members given that assignment.
+    cost = group_preferences.ravel()
+
+    # Each member of a group takes an assignment at most once.
+    variable_bounds = Bounds(0, np.repeat(group_sizes, n_assignments))
+
+    # Constraint that each person must be assigned their count of assignments:
+    # row i of the variable matrix sums to group i's size times its count.
+    group_totals = group_sizes * group_counts
+    persons_matrix = sparse.kron(
+        sparse.eye(n_groups), np.ones((1, n_assignments)), format="csr"
+    )
+    persons_constraint = LinearConstraint(persons_matrix, group_totals, group_totals)
 
+    # Constraint that each assignment gets its count of persons.
+    # Works similarly as above, but over columns.
+    assignments_matrix = sparse.kron(
+        np.ones((1, n_groups)), sparse.eye(n_assignments), format="csr"
+    )
+    lower, upper = bounds_limits(bounds, assignment_counts, group_totals.sum())
+    assignments_constraint = LinearConstraint(assignments_matrix, lower, upper)
+    logging.debug("Created constraints.")
+    return cost, [persons_constraint, assignments_constraint], variable_bounds
+
+
+def solve_ilp(
+    cost: np.ndarray, constraints: list[LinearConstraint], variable_bounds: Bounds
+) -> np.ndarray:
+    """Solve the ILP with HiGHS through scipy."""
+    logging.debug("Using HiGHS to solve")
+    result = milp(
+        cost,
+        constraints=constraints,
+        integrality=np.ones_like(cost),
+        bounds=variable_bounds,
+        options=MILP_OPTIONS,
+    )
 
-def set_final_assignments(variables_by_persons: dict[str, list]) -> dict[str, list]:
-    """Figure out the final assignments by checking which variables were 1."""
+    logging.info("Problem Value %s", result.fun)
+    if result.status != 0:
+        logging.warning("Problem status is not optimal: %s", result.message)
+    if result.x is None:
+        raise RuntimeError(f"No assignment found: {result.message}")
+    return result.x
+
+
+def set_final_assignments(
+    solution: np.ndarray,
+    group_preferences: np.ndarray,
+    group_sizes: np.ndarray,
+    group_of_person: np.ndarray,
+    persons: list[str],
+    assignments: list[str],
+) -> dict[str, list]:
+    """Figure out the final assignments by dealing out each group's solution."""
     final_assignments = defaultdict(list)
-    for person, items in variables_by_persons.items():
-        for preference, assignment, variable in items:
-            if math.isclose(variable.value[0], 1):
-                final_assignments[person].append((assignment, preference))
+    # Round rather than compare, since solvers only get within tolerance.
+    solution = np.rint(solution).astype(np.int64).reshape(group_preferences.shape)
+    # Lay out each group's assignments in order. An assignment appears at most
+    # group size times, so dealing them round-robin never hands a person the
+    # same assignment twice.
+    slots = [np.repeat(np.arange(solution.shape[1]), row) for row in solution]
+    dealt = np.zeros(len(group_sizes), dtype=np.int64)
+    for person, group in zip(persons, group_of_person.tolist()):
+        cols = slots[group][dealt[group] :: group_sizes[group]]
+        dealt[group] += 1
+        weights = group_preferences[group, cols]
+        for j, weight in zip(cols.tolist(), weights.tolist()):
+            final_assignments[person].append((assignments[j], weight))
     return final_assignments
 
 
 def write_final_assignments(final_assignments, output_file) -> None:
     """Write out the final assignments."""
-    with open(output_file, "w+") as csvfile:
+    rows = [
+        [person, assignment, WEIGHTS_TO_PREF[weight]]
+        for person, items in final_assignments.items()
+        for assignment, weight in items
+    ]
+    with open(output_file, "w", newline="", buffering=1 << 20) as csvfile:
         logging.debug("Writing to output file.")
         csvwriter = csv.writer(csvfile)
         csvwriter.writerow(["Person", "Assignment", "Preference"])
-        for person, items in final_assignments.items():
-            for assignment, weight in items:
-                csvwriter.writerow([person, assignment, WEIGHTS_TO_PREF[weight]])
-                logging.info(
-                    f"Made assignment: {person}, {assignment}, {WEIGHTS_TO_PREF[weight]}"
-                )
+        csvwriter.writerows(rows)
+    logging.info("Wrote %d assignments", len(rows))
 
 
 def main() -> None:
     """Solve the scheduling problem."""
-    logging.basicConfig(filename=LOGGING_FILENAME, level=logging.DEBUG)
+    logging.basicConfig(filename=LOGGING_FILENAME, level=logging.INFO)
     parser = argparse.ArgumentParser(
         description="""
     A solution for scheduling hell!
@@ -245,20 +294,42 @@ def main() -> None:
         choices=["lower", "upper", "equal"],
         help="Use this flag to specify that the provided counts in the CSV are merely a {lower,upper,tight} bound, and {more,fewer,exactly} persons than provided in the counts can be assigned if required. Default assumes that the requirement is tight.",
     )
+    parser.add_argument(
+        "--verbose",
+        action="store_true",
+        help="Write debug messages to the log file.",
+    )
     args = parser.parse_args()
+    if args.verbose:
+        logging.getLogger().setLevel(logging.DEBUG)
     bounds = args.bounds if args.bounds else "equal"
 
     (
-        counts_by_persons,
-        counts_by_assignment,
-        preferences_by_persons,
-        _,
+        preference_matrix,
+        person_counts,
+        assignment_counts,
+        persons,
+        assignments,
     ) = parse_csv(args.input, args.no_custom_counts)
-    variables_by_persons, cost, persons_constraint, assignments_constraint = create_ilp(
-        preferences_by_persons, counts_by_persons, counts_by_assignment, bounds
+    (
+        group_preferences,
+        group_person_counts,
+        group_sizes,
+        group_of_person,
+    ) = group_persons(preference_matrix, person_counts)
+    logging.info("Number of distinct persons %d", len(group_sizes))
+    cost, constraints, variable_bounds = create_ilp(
+        group_preferences, group_person_counts, group_sizes, assignment_counts, bounds
+    )
+    solution = solve_ilp(cost, constraints, variable_bounds)
+    final_assignments = set_final_assignments(
+        solution,
+        group_preferences,
+        group_sizes,
+        group_of_person,
+        persons,
+        assignments,
     )
-    solve_ilp(cost, persons_constraint, assignments_constraint)
-    final_assignments = set_final_assignments(variables_by_persons)
     write_final_assignments(final_assignments, args.output)
 
 